@@ -1,15 +1,13 @@
 """Code for the age estimation application."""
-import numpy as np
 import torch
 import torchvision as torchvision
-from scipy.stats import norm
 from torch.utils.data import DataLoader
 
 from age.data import AgeDataset
 from age.models import Generator, Discriminator
 from age.vgg import vgg16
 from srgan import Experiment
-from utility import seed_all, gpu, MixtureModel, to_image_range
+from utility import seed_all, gpu, to_image_range
 
 model_architecture = 'dcgan'  # dcgan or vgg
 
@@ -82,8 +80,7 @@ class AgeExperiment(Experiment):
         fake_images_image = torchvision.utils.make_grid(to_image_range(fake_examples.data[:9]), normalize=True,
                                                         range=(0, 255), nrow=3)
         gan_summary_writer.add_image('Fake/Standard', fake_images_image.numpy())
-        z = torch.as_tensor(MixtureModel([norm(-settings.mean_offset, 1), norm(settings.mean_offset, 1)]
-                                         ).rvs(size=[settings.batch_size, G.input_size]).astype(np.float32)).to(gpu)
+        z = self.mixture_noise(settings.batch_size)
         fake_examples = G(z).to('cpu')
         fake_images_image = torchvision.utils.make_grid(to_image_range(fake_examples.data[:9]), normalize=True,
                                                         range=(0, 255), nrow=3)
@@ -92,15 +89,16 @@ class AgeExperiment(Experiment):
     def evaluation_epoch(self, settings, network, dataset, summary_writer, summary_name, comparison_value=None):
         """Runs the evaluation and summaries for the data in the dataset."""
         dataset_loader = DataLoader(dataset, batch_size=settings.batch_size)
-        predicted_ages, ages = np.array([]), np.array([])
+        predicted_ages_list, ages_list = [], []
         for images, labels in dataset_loader:
-            batch_predicted_ages = self.images_to_predicted_ages(network, images.to(gpu))
-            batch_predicted_ages = batch_predicted_ages.detach().to('cpu').view(-1).numpy()
-            ages = np.concatenate([ages, labels])
-            predicted_ages = np.concatenate([predicted_ages, batch_predicted_ages])
-        mae = np.abs(predicted_ages - ages).mean()
+            batch_predicted_ages = self.images_to_predicted_ages(network, images.to(gpu, non_blocking=True))
+            predicted_ages_list.append(batch_predicted_ages.detach().view(-1))
+            ages_list.append(labels.to(gpu, dtype=torch.float32, non_blocking=True).view(-1))
+        predicted_ages, ages = torch.cat(predicted_ages_list), torch.cat(ages_list)
+        errors = predicted_ages - ages
+        mae = errors.abs().mean().item()
         summary_writer.add_scalar('{}/MAE'.format(summary_name), mae, )
-        mse = (np.abs(predicted_ages - ages) ** 2).mean()
+        mse = errors.pow(2).mean().item()
         summary_writer.add_scalar('{}/MSE'.format(summary_name), mse, )
         if comparison_value is not None:
             summary_writer.add_scalar('{}/Ratio MAE GAN DNN'.format(summary_name), mae / comparison_value, )
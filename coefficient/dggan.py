@@ -2,10 +2,10 @@
 from torch.nn import BCEWithLogitsLoss
 import numpy as np
 import torch
-from scipy.stats import norm, wasserstein_distance
+from scipy.stats import wasserstein_distance
 
 from coefficient.presentation import generate_display_frame
-from utility import standard_image_format_to_tensorboard_image_format, gpu, MixtureModel
+from utility import standard_image_format_to_tensorboard_image_format, gpu
 from coefficient.models import DgganMLP, Generator
 from coefficient.srgan import CoefficientExperiment
 
@@ -92,8 +92,7 @@ class CoefficientDgganExperiment(CoefficientExperiment):
         gan_summary_writer.add_scalar('1 Validation Error/MAE', gan_validation_label_errors, )
         gan_summary_writer.add_scalar('1 Validation Error/Ratio MAE GAN DNN',
                                       gan_validation_label_errors / dnn_validation_label_errors, )
-        z = torch.tensor(MixtureModel([norm(-settings.mean_offset, 1), norm(settings.mean_offset, 1)]).rvs(
-            size=[settings.batch_size, G.input_size]).astype(np.float32)).to(gpu)
+        z = self.mixture_noise(settings.batch_size)
         fake_examples = G(z, add_noise=False)
         fake_examples_array = fake_examples.to('cpu').detach().numpy()
         fake_predicted_labels = D(fake_examples)[0]
@@ -3,7 +3,7 @@ Code for the coefficient application.
 """
 import numpy as np
 import torch
-from scipy.stats import norm, wasserstein_distance
+from scipy.stats import wasserstein_distance
 from torch.utils.data import DataLoader
 from recordclass import RecordClass
 
@@ -11,7 +11,7 @@ from srgan import Experiment
 from coefficient.data import ToyDataset
 from coefficient.models import Generator, MLP, observation_count
 from coefficient.presentation import generate_display_frame
-from utility import gpu, MixtureModel, standard_image_format_to_tensorboard_image_format
+from utility import gpu, standard_image_format_to_tensorboard_image_format
 
 
 class CoefficientExperiment(Experiment):
@@ -53,8 +53,7 @@ class CoefficientExperiment(Experiment):
         gan_train_values = self.evaluation_epoch(D, train_dataset, gan_summary_writer, '2 Train Error')
         gan_validation_values = self.evaluation_epoch(D, validation_dataset, gan_summary_writer, '1 Validation Error',
                               comparison_values=dnn_validation_values)
-        z = torch.tensor(MixtureModel([norm(-settings.mean_offset, 1), norm(settings.mean_offset, 1)]).rvs(
-            size=[settings.batch_size, G.input_size]).astype(np.float32)).to(gpu)
+        z = self.mixture_noise(settings.batch_size)
         fake_examples = G(z, add_noise=False)
         fake_examples_array = fake_examples.to('cpu').detach().numpy()
         fake_predicted_labels = D(fake_examples)
@@ -9,6 +9,8 @@ import numpy as np
 import torchvision
 from torch.utils.data import Dataset
 
+from utility import to_normalized_range
+
 
 class CrowdDataset(Enum):
     """An enum to select the crowd dataset."""
@@ -128,6 +130,41 @@ class NegativeOneToOneNormalizeImage:
         return example
 
 
+class BatchRandomHorizontalFlip(torch.nn.Module):
+    """
+    Randomly flips each example of a batch horizontally (when in Torch NCHW form, with NHW labels and maps).
+    """
+
+    def forward(self, batch):
+        """
+        :param batch: The batch of images, followed by any labels or maps of the same spatial size.
+        :type batch: list[torch.Tensor]
+        :return: The batch with each example possibly flipped.
+        :rtype: list[torch.Tensor]
+        """
+        flip_mask = torch.rand(batch[0].size(0), device=batch[0].device) < 0.5
+        flipped_batch = []
+        for tensor in batch:
+            tensor_flip_mask = flip_mask.view(-1, *([1] * (tensor.dim() - 1)))
+            flipped_batch.append(torch.where(tensor_flip_mask, tensor.flip(-1), tensor))
+        return flipped_batch
+
+
+class BatchNegativeOneToOneNormalizeImage(torch.nn.Module):
+    """
+    Normalizes a batch of 0 to 255 images to range -1 to 1 (when in Torch NCHW form).
+    """
+
+    def forward(self, batch):
+        """
+        :param batch: The batch of images, followed by any labels or maps.
+        :type batch: list[torch.Tensor]
+        :return: The batch with the images from -1 to 1.
+        :rtype: list[torch.Tensor]
+        """
+        return [to_normalized_range(batch[0]), *batch[1:]]
+
+
 class PatchAndRescale:
     """
     Select a patch based on a position and rescale it based on the perspective map.
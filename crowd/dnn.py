@@ -3,7 +3,7 @@ Code for running only the DNN version of the crowd application.
 """
 import random
 from collections import defaultdict
-import numpy as np
+import torch
 from torch.utils.data import DataLoader
 
 from crowd import data
@@ -14,7 +14,6 @@ from crowd.srgan import CrowdExperiment
 from crowd.ucf_cc_50_data import UcfCc50FullImageDataset, UcfCc50TransformedDataset
 from crowd.ucf_qnrf_data import UcfQnrfFullImageDataset, UcfQnrfTransformedDataset
 from dnn import DnnExperiment
-from utility import gpu
 
 
 class CrowdDnnExperiment(DnnExperiment, CrowdExperiment):
@@ -28,8 +27,7 @@ class CrowdDnnExperiment(DnnExperiment, CrowdExperiment):
                                                            seed=settings.labeled_dataset_seed,
                                                            number_of_examples=settings.labeled_dataset_size)
             self.train_dataset_loader = DataLoader(self.train_dataset, batch_size=settings.batch_size,
-                                                   pin_memory=self.settings.pin_memory,
-                                                   num_workers=settings.number_of_data_workers)
+                                                   **self.data_loader_options())
             self.validation_dataset = UcfQnrfTransformedDataset(dataset='test', seed=101)
         elif settings.crowd_dataset == CrowdDataset.shanghai_tech:
             self.dataset_class = ShanghaiTechFullImageDataset
@@ -40,8 +38,7 @@ class CrowdDnnExperiment(DnnExperiment, CrowdExperiment):
                                                                 image_patch_size=self.settings.image_patch_size,
                                                                 label_patch_size=self.settings.label_patch_size)
             self.train_dataset_loader = DataLoader(self.train_dataset, batch_size=settings.batch_size,
-                                                   pin_memory=self.settings.pin_memory,
-                                                   num_workers=settings.number_of_data_workers)
+                                                   **self.data_loader_options())
             self.validation_dataset = ShanghaiTechTransformedDataset(dataset='test', seed=101,
                                                                      map_directory_name=settings.map_directory_name,
                                                                      image_patch_size=self.settings.image_patch_size,
@@ -55,8 +52,7 @@ class CrowdDnnExperiment(DnnExperiment, CrowdExperiment):
                                                            inverse_map=settings.inverse_map,
                                                            map_directory_name=settings.map_directory_name)
             self.train_dataset_loader = DataLoader(self.train_dataset, batch_size=settings.batch_size,
-                                                   pin_memory=self.settings.pin_memory,
-                                                   num_workers=settings.number_of_data_workers)
+                                                   **self.data_loader_options())
             self.validation_dataset = UcfCc50TransformedDataset(dataset='test', seed=seed,
                                                                 test_start=settings.labeled_dataset_seed * 10,
                                                                 inverse_map=settings.inverse_map,
@@ -66,7 +62,7 @@ class CrowdDnnExperiment(DnnExperiment, CrowdExperiment):
 
     def model_setup(self):
         """Prepares all the model architectures required for the application."""
-        self.DNN = KnnDenseNetCat(label_patch_size=self.settings.label_patch_size)
+        self.DNN = KnnDenseNetCat(label_patch_size=self.settings.label_patch_size).to(memory_format=torch.channels_last)
 
     def validation_summaries(self, step):
         """Prepares the summaries that should be run for the given application."""
@@ -79,15 +75,15 @@ class CrowdDnnExperiment(DnnExperiment, CrowdExperiment):
         self.evaluation_epoch(settings, DNN, train_dataset, dnn_summary_writer, '2 Train Error', shuffle=False)
         self.evaluation_epoch(settings, DNN, validation_dataset, dnn_summary_writer, '1 Validation Error',
                               shuffle=False)
-        train_iterator = iter(DataLoader(train_dataset, batch_size=settings.batch_size))
-        images, densities, maps = next(train_iterator)
-        dnn_predicted_densities, _, predicted_maps = DNN(images.to(gpu))
-        dnn_real_comparison_image = self.create_map_comparison_image(images, maps, predicted_maps.to('cpu'))
+        images, densities, maps = next(self.evaluation_batches(train_dataset))
+        gpu_images = self.dataset_images_to_device(images, train_dataset)
+        dnn_predicted_densities, _, predicted_maps = DNN(gpu_images)
+        dnn_real_comparison_image = self.create_map_comparison_image(gpu_images, maps, predicted_maps.to('cpu'))
         dnn_summary_writer.add_image('Real', dnn_real_comparison_image)
-        validation_iterator = iter(DataLoader(train_dataset, batch_size=settings.batch_size))
-        images, densities, maps = next(validation_iterator)
-        dnn_predicted_densities, _, predicted_maps = DNN(images.to(gpu))
-        dnn_validation_comparison_image = self.create_map_comparison_image(images, maps, predicted_maps.to('cpu'))
+        images, densities, maps = next(self.evaluation_batches(train_dataset))
+        gpu_images = self.dataset_images_to_device(images, train_dataset)
+        dnn_predicted_densities, _, predicted_maps = DNN(gpu_images)
+        dnn_validation_comparison_image = self.create_map_comparison_image(gpu_images, maps, predicted_maps.to('cpu'))
         dnn_summary_writer.add_image('Validation', dnn_validation_comparison_image)
 
         self.test_summaries()
@@ -105,11 +101,13 @@ class CrowdDnnExperiment(DnnExperiment, CrowdExperiment):
             full_image, full_label, full_map = test_dataset[index]
             full_example = CrowdExample(image=full_image, label=full_label)
             full_predicted_count, full_predicted_label = self.predict_full_example(full_example, network)
-            totals['Count error'] += np.abs(full_predicted_count - full_example.label.sum())
-            totals['NAE'] += np.abs(full_predicted_count - full_example.label.sum()) / full_example.label.sum()
-            totals['Density sum error'] += np.abs(full_predicted_label.sum() - full_example.label.sum())
-            totals['SE count'] += (full_predicted_count - full_example.label.sum()) ** 2
-            totals['SE density'] += (full_predicted_label.sum() - full_example.label.sum()) ** 2
+            label_sum = float(full_example.label.sum())
+            totals['Count error'] += (full_predicted_count - label_sum).abs()
+            totals['NAE'] += (full_predicted_count - label_sum).abs() / label_sum
+            totals['Density sum error'] += (full_predicted_label.sum() - label_sum).abs()
+            totals['SE count'] += (full_predicted_count - label_sum) ** 2
+            totals['SE density'] += (full_predicted_label.sum() - label_sum) ** 2
+        totals = {key: value.item() for key, value in totals.items()}
         summary_writer = self.dnn_summary_writer
         nae_count = totals['NAE'] / len(indexes)
         summary_writer.add_scalar('0 Test Error/NAE count', nae_count)
@@ -140,10 +138,12 @@ class CrowdDnnExperiment(DnnExperiment, CrowdExperiment):
             full_image, full_label = test_dataset[index]
             full_example = CrowdExample(image=full_image, label=full_label)
             full_predicted_count, full_predicted_label = self.predict_full_example(full_example, network)
-            totals['Count error'] += np.abs(full_predicted_count - full_example.label.sum())
-            totals['Density sum error'] += np.abs(full_predicted_label.sum() - full_example.label.sum())
-            totals['SE count'] += (full_predicted_count - full_example.label.sum()) ** 2
-            totals['SE density'] += (full_predicted_label.sum() - full_example.label.sum()) ** 2
+            label_sum = float(full_example.label.sum())
+            totals['Count error'] += (full_predicted_count - label_sum).abs()
+            totals['Density sum error'] += (full_predicted_label.sum() - label_sum).abs()
+            totals['SE count'] += (full_predicted_count - label_sum) ** 2
+            totals['SE density'] += (full_predicted_label.sum() - label_sum) ** 2
+        totals = {key: value.item() for key, value in totals.items()}
         print('Count MAE: {}'.format(totals['Count error'] / len(indexes)))
         print('Count RMSE: {}'.format((totals['SE count'] / len(indexes)) ** 0.5))
         print('Density MAE: {}'.format(totals['Density sum error'] / len(indexes)))
@@ -49,7 +49,8 @@ class ShanghaiTechTransformedDataset(Dataset):
     A class for the transformed ShanghaiTech crowd dataset.
     """
     def __init__(self, dataset='train', image_patch_size=224, label_patch_size=224, seed=None, part='part_A',
-                 number_of_examples=None, middle_transform=None, map_directory_name='knn_maps'):
+                 number_of_examples=None, middle_transform=None, map_directory_name='knn_maps',
+                 normalize_image=True):
         seed_all(seed)
         self.dataset_directory = os.path.join(ShanghaiTechPreprocessor().database_directory,
                                               part, '{}_data'.format(dataset))
@@ -68,6 +69,7 @@ class ShanghaiTechTransformedDataset(Dataset):
             image_indexes_length = len(y_positions) * len(x_positions)
             self.length += image_indexes_length
         self.middle_transform = middle_transform
+        self.normalize_image = normalize_image
         self.map_directory_name = map_directory_name
 
     def __getitem__(self, index):
@@ -84,8 +86,11 @@ class ShanghaiTechTransformedDataset(Dataset):
         position_index = index_ - start_index
         extract_patch_transform = ExtractPatchForPosition(self.image_patch_size, self.label_patch_size,
                                                           allow_padded=True)  # In case image is smaller than patch.
-        preprocess_transform = torchvision.transforms.Compose([NegativeOneToOneNormalizeImage(),
-                                                               NumpyArraysToTorchTensors()])
+        if self.normalize_image:
+            preprocess_transform = torchvision.transforms.Compose([NegativeOneToOneNormalizeImage(),
+                                                                   NumpyArraysToTorchTensors()])
+        else:
+            preprocess_transform = NumpyArraysToTorchTensors()
         image = np.load(os.path.join(self.dataset_directory, 'images', file_name), mmap_mode='r')
         label = np.load(os.path.join(self.dataset_directory, 'labels', file_name), mmap_mode='r')
         map_ = np.load(os.path.join(self.dataset_directory, self.map_directory_name, file_name), mmap_mode='r')
@@ -7,12 +7,11 @@ import random
 from collections import defaultdict
 
 import imageio
-import scipy.misc
-import matplotlib
+import matplotlib.cm
 import numpy as np
 import torch
-from scipy.stats import norm
 import torchvision
+from torch.nn import functional as F
 from torch.utils.data import DataLoader
 
 from crowd import data
@@ -22,78 +21,77 @@ from crowd.shanghai_tech_data import ShanghaiTechFullImageDataset, ShanghaiTechT
 from crowd.ucf_qnrf_data import UcfQnrfFullImageDataset, UcfQnrfTransformedDataset
 from crowd.world_expo_data import WorldExpoFullImageDataset, WorldExpoTransformedDataset
 from srgan import Experiment
-from utility import MixtureModel, gpu
+from utility import gpu, OnnxNetwork, to_normalized_range, to_image_range
 
 
 class CrowdExperiment(Experiment):
     """The crowd application."""
+    heatmap_mappable = matplotlib.cm.ScalarMappable(cmap='inferno')
+    evaluation_example_limit = 100  # The evaluation epoch stops once it has evaluated this many examples.
 
     def dataset_setup(self):
         """Sets up the datasets for the application."""
         settings = self.settings
         if settings.crowd_dataset == CrowdDataset.ucf_qnrf:
             self.dataset_class = UcfQnrfFullImageDataset
-            self.train_dataset = UcfQnrfTransformedDataset(middle_transform=data.RandomHorizontalFlip(),
+            self.train_dataset = UcfQnrfTransformedDataset(normalize_image=False,
                                                            seed=settings.labeled_dataset_seed,
                                                            number_of_examples=settings.labeled_dataset_size,
                                                            map_directory_name=settings.map_directory_name)
             self.train_dataset_loader = DataLoader(self.train_dataset, batch_size=settings.batch_size,
-                                                   pin_memory=self.settings.pin_memory,
-                                                   num_workers=settings.number_of_data_workers)
-            self.unlabeled_dataset = UcfQnrfTransformedDataset(middle_transform=data.RandomHorizontalFlip(),
+                                                   **self.data_loader_options())
+            self.unlabeled_dataset = UcfQnrfTransformedDataset(normalize_image=False,
                                                                seed=settings.labeled_dataset_seed,
                                                                number_of_examples=settings.unlabeled_dataset_size,
                                                                map_directory_name=settings.map_directory_name,
                                                                examples_start=settings.labeled_dataset_size)
             self.unlabeled_dataset_loader = DataLoader(self.unlabeled_dataset, batch_size=settings.batch_size,
-                                                       pin_memory=self.settings.pin_memory,
-                                                       num_workers=settings.number_of_data_workers)
+                                                       **self.data_loader_options())
             self.validation_dataset = UcfQnrfTransformedDataset(dataset='test', seed=101,
                                                                 map_directory_name=settings.map_directory_name)
         elif settings.crowd_dataset == CrowdDataset.shanghai_tech:
             self.dataset_class = ShanghaiTechFullImageDataset
-            self.train_dataset = ShanghaiTechTransformedDataset(middle_transform=data.RandomHorizontalFlip(),
+            self.train_dataset = ShanghaiTechTransformedDataset(normalize_image=False,
                                                                 seed=settings.labeled_dataset_seed,
                                                                 number_of_examples=settings.labeled_dataset_size,
                                                                 map_directory_name=settings.map_directory_name)
             self.train_dataset_loader = DataLoader(self.train_dataset, batch_size=settings.batch_size,
-                                                   pin_memory=self.settings.pin_memory,
-                                                   num_workers=settings.number_of_data_workers)
-            self.unlabeled_dataset = ShanghaiTechTransformedDataset(middle_transform=data.RandomHorizontalFlip(),
+                                                   **self.data_loader_options())
+            self.unlabeled_dataset = ShanghaiTechTransformedDataset(normalize_image=False,
                                                                     seed=100,
                                                                     number_of_examples=settings.unlabeled_dataset_size,
                                                                     map_directory_name=settings.map_directory_name)
             self.unlabeled_dataset_loader = DataLoader(self.train_dataset, batch_size=settings.batch_size,
-                                                       pin_memory=self.settings.pin_memory,
-                                                       num_workers=settings.number_of_data_workers)
+                                                       **self.data_loader_options())
             self.validation_dataset = ShanghaiTechTransformedDataset(dataset='test', seed=101,
                                                                      map_directory_name=settings.map_directory_name)
 
         elif settings.crowd_dataset == CrowdDataset.world_expo:
             self.dataset_class = WorldExpoFullImageDataset
-            self.train_dataset = WorldExpoTransformedDataset(middle_transform=data.RandomHorizontalFlip(),
+            self.train_dataset = WorldExpoTransformedDataset(normalize_image=False,
                                                              seed=settings.labeled_dataset_seed,
                                                              number_of_cameras=settings.number_of_cameras,
                                                              number_of_images_per_camera=settings.number_of_images_per_camera)
             self.train_dataset_loader = DataLoader(self.train_dataset, batch_size=settings.batch_size,
-                                                   pin_memory=self.settings.pin_memory,
-                                                   num_workers=settings.number_of_data_workers)
-            self.unlabeled_dataset = WorldExpoTransformedDataset(middle_transform=data.RandomHorizontalFlip(),
+                                                   **self.data_loader_options())
+            self.unlabeled_dataset = WorldExpoTransformedDataset(normalize_image=False,
                                                                  seed=settings.labeled_dataset_seed,
                                                                  number_of_cameras=settings.number_of_cameras,
                                                                  number_of_images_per_camera=settings.number_of_images_per_camera)
             self.unlabeled_dataset_loader = DataLoader(self.unlabeled_dataset, batch_size=settings.batch_size,
-                                                       pin_memory=self.settings.pin_memory,
-                                                       num_workers=settings.number_of_data_workers)
+                                                       **self.data_loader_options())
             self.validation_dataset = WorldExpoTransformedDataset(dataset='validation', seed=101)
             if self.settings.batch_size > self.train_dataset.length:
                 self.settings.batch_size = self.train_dataset.length
+        # The training flips and normalization are applied batch-wise on the device.
+        self.batch_transform = torch.nn.Sequential(data.BatchRandomHorizontalFlip(),
+                                                   data.BatchNegativeOneToOneNormalizeImage()).to(gpu)
 
     def model_setup(self):
         """Prepares all the model architectures required for the application."""
-        self.G = DCGenerator()
-        self.D = KnnDenseNetCat()
-        self.DNN = KnnDenseNetCat()
+        self.G = DCGenerator().to(memory_format=torch.channels_last)
+        self.D = KnnDenseNetCat().to(memory_format=torch.channels_last)
+        self.DNN = KnnDenseNetCat().to(memory_format=torch.channels_last)
 
     def validation_summaries(self, step):
         """Prepares the summaries that should be run for the given application."""
@@ -117,74 +115,73 @@ class CrowdExperiment(Experiment):
         self.evaluation_epoch(settings, D, validation_dataset, gan_summary_writer, '1 Validation Error',
                               comparison_value=dnn_validation_count_mae, shuffle=False)
         # Real images.
-        train_iterator = iter(DataLoader(train_dataset, batch_size=settings.batch_size))
-        images, densities, maps = next(train_iterator)
-        predicted_densities, _, predicted_maps = D(images.to(gpu))
-        real_comparison_image = self.create_map_comparison_image(images, maps, predicted_maps.to('cpu'))
+        images, densities, maps = next(self.evaluation_batches(train_dataset))
+        gpu_images = self.dataset_images_to_device(images, train_dataset)
+        predicted_densities, _, predicted_maps = D(gpu_images)
+        real_comparison_image = self.create_map_comparison_image(gpu_images, maps, predicted_maps.to('cpu'))
         gan_summary_writer.add_image('Real', real_comparison_image)
-        dnn_predicted_densities, _, predicted_maps = DNN(images.to(gpu))
-        dnn_real_comparison_image = self.create_map_comparison_image(images, maps, predicted_maps.to('cpu'))
+        dnn_predicted_densities, _, predicted_maps = DNN(gpu_images)
+        dnn_real_comparison_image = self.create_map_comparison_image(gpu_images, maps, predicted_maps.to('cpu'))
         dnn_summary_writer.add_image('Real', dnn_real_comparison_image)
-        validation_iterator = iter(DataLoader(train_dataset, batch_size=settings.batch_size))
-        images, densities, maps = next(validation_iterator)
-        predicted_densities, _, predicted_maps = D(images.to(gpu))
-        validation_comparison_image = self.create_map_comparison_image(images, maps, predicted_maps.to('cpu'))
+        images, densities, maps = next(self.evaluation_batches(train_dataset))
+        gpu_images = self.dataset_images_to_device(images, train_dataset)
+        predicted_densities, _, predicted_maps = D(gpu_images)
+        validation_comparison_image = self.create_map_comparison_image(gpu_images, maps, predicted_maps.to('cpu'))
         gan_summary_writer.add_image('Validation', validation_comparison_image)
-        dnn_predicted_densities, _, predicted_maps = DNN(images.to(gpu))
-        dnn_validation_comparison_image = self.create_map_comparison_image(images, maps, predicted_maps.to('cpu'))
+        dnn_predicted_densities, _, predicted_maps = DNN(gpu_images)
+        dnn_validation_comparison_image = self.create_map_comparison_image(gpu_images, maps, predicted_maps.to('cpu'))
         dnn_summary_writer.add_image('Validation', dnn_validation_comparison_image)
         # Generated images.
         z = torch.randn(settings.batch_size, G.input_size)
-        fake_examples = G(z.to(gpu)).to('cpu')
-        fake_images_image = torchvision.utils.make_grid(fake_examples.data[:9], normalize=True, range=(-1, 1), nrow=3)
-        gan_summary_writer.add_image('Fake/Standard', fake_images_image.numpy())
-        z = torch.as_tensor(MixtureModel([norm(-settings.mean_offset, 1), norm(settings.mean_offset, 1)]
-                                         ).rvs(size=[settings.batch_size, G.input_size]).astype(np.float32))
-        fake_examples = G(z.to(gpu)).to('cpu')
-        fake_images_image = torchvision.utils.make_grid(fake_examples.data[:9], normalize=True, range=(-1, 1), nrow=3)
-        gan_summary_writer.add_image('Fake/Offset', fake_images_image.numpy())
+        fake_examples = G(z.to(gpu, non_blocking=True))
+        gan_summary_writer.add_image('Fake/Standard', self.create_fake_images_grid_image(fake_examples))
+        z = self.mixture_noise(settings.batch_size)
+        fake_examples = G(z)
+        gan_summary_writer.add_image('Fake/Offset', self.create_fake_images_grid_image(fake_examples))
 
         self.test_summaries()
 
+    @staticmethod
+    def dataset_images_to_device(images, dataset):
+        """
+        Moves a batch of dataset images to the device in the form the networks take. Datasets which leave the
+        normalization to the batch transform have their images normalized once they are on the device.
+        """
+        images = images.to(gpu, non_blocking=True)
+        if not getattr(dataset, 'normalize_image', True):
+            images = to_normalized_range(images)
+        return images.contiguous(memory_format=torch.channels_last)
+
     def evaluation_epoch(self, settings, network, dataset, summary_writer, summary_name, comparison_value=None,
                          shuffle=True):
         """Runs the evaluation and summaries for the data in the dataset."""
-        dataset_loader = DataLoader(dataset, batch_size=settings.batch_size, shuffle=shuffle)
-        predicted_counts, densities, predicted_densities, maps, predicted_maps = np.array([]), np.array(
-            []), np.array([]), np.array([]), np.array([])
-        for index, (images, labels, batch_maps) in enumerate(dataset_loader):
-            images, labels = images.to(gpu), labels.to(gpu)
-            (batch_predicted_densities, batch_predicted_counts, batch_predicted_maps
-             ) = self.images_to_predicted_labels(network, images)
-            labels = labels.to('cpu')
-            batch_predicted_densities = batch_predicted_densities.detach().to('cpu').numpy()
-            batch_predicted_maps = batch_predicted_maps.detach().to('cpu').numpy()
-            batch_predicted_counts = batch_predicted_counts.detach().to('cpu').numpy()
-            predicted_counts = np.concatenate([predicted_counts, batch_predicted_counts])
-            if predicted_densities.size == 0:
-                predicted_densities = predicted_densities.reshape([0, *batch_predicted_densities.shape[1:]])
-            predicted_densities = np.concatenate([predicted_densities, batch_predicted_densities])
-            if densities.size == 0:
-                densities = densities.reshape([0, *labels.shape[1:]])
-            densities = np.concatenate([densities, labels])
-            if maps.size == 0:
-                maps = maps.reshape([0, *batch_maps.shape[1:]])
-                maps = np.concatenate([maps, batch_maps])
-            if predicted_maps.size == 0:
-                predicted_maps = predicted_maps.reshape([0, *batch_predicted_maps.shape[1:]])
-                predicted_maps = np.concatenate([predicted_maps, batch_predicted_maps])
-            if index * self.settings.batch_size >= 100:
-                break
-        maps = np.expand_dims(maps, axis=1)
-        count_me = (predicted_counts - densities.sum(1).sum(1)).mean()
+        batches = self.evaluation_batches(dataset, shuffle=shuffle)
+        predicted_counts_list, densities_list, maps_list, predicted_maps_list = [], [], [], []
+        example_count = 0
+        while example_count < min(len(dataset), self.evaluation_example_limit):
+            images, labels, batch_maps = next(batches)
+            images = self.dataset_images_to_device(images, dataset)
+            with self.evaluation_autocast():  # Only the training summaries use mixed precision, not the test metrics.
+                (batch_predicted_densities, batch_predicted_counts, batch_predicted_maps
+                 ) = self.images_to_predicted_labels(network, images)
+            predicted_counts_list.append(batch_predicted_counts.detach().view(-1))
+            densities_list.append(labels.to(gpu, non_blocking=True))
+            maps_list.append(batch_maps.to(gpu, non_blocking=True))
+            predicted_maps_list.append(batch_predicted_maps.detach())
+            example_count += images.size(0)
+        predicted_counts, densities = torch.cat(predicted_counts_list), torch.cat(densities_list)
+        maps, predicted_maps = torch.cat(maps_list).unsqueeze(1), torch.cat(predicted_maps_list)
+        count_errors = predicted_counts - densities.sum(dim=(1, 2))
+        map_errors = predicted_maps - maps
+        count_me = count_errors.mean().item()
         summary_writer.add_scalar('{}/ME'.format(summary_name), count_me)
-        count_mae = np.abs(predicted_counts - densities.sum(1).sum(1)).mean()
+        count_mae = count_errors.abs().mean().item()
         summary_writer.add_scalar('{}/MAE'.format(summary_name), count_mae)
-        density_mae = np.abs(predicted_maps - maps).mean()
+        density_mae = map_errors.abs().mean().item()
         summary_writer.add_scalar('{}/kNN MAE'.format(summary_name), density_mae)
-        count_mse = (np.abs(predicted_counts - densities.sum(1).sum(1)) ** 2).mean()
+        count_mse = count_errors.pow(2).mean().item()
         summary_writer.add_scalar('{}/MSE'.format(summary_name), count_mse)
-        density_mse = (np.abs(predicted_maps - maps) ** 2).mean()
+        density_mse = map_errors.pow(2).mean().item()
         summary_writer.add_scalar('{}/kNN MSE'.format(summary_name), density_mse)
         if comparison_value is not None:
             summary_writer.add_scalar('{}/Ratio MAE GAN DNN'.format(summary_name), count_mae / comparison_value)
@@ -192,7 +189,8 @@ class CrowdExperiment(Experiment):
 
     def convert_density_maps_to_heatmaps(self, label, predicted_label):
         """
-        Converts a label and predicted label density map into their respective heatmap images.
+        Converts a label and predicted label density map (already resized to the image patch size) into their
+        respective heatmap images.
 
         :param label: The label tensor.
         :type label: torch.autograd.Variable
@@ -201,21 +199,31 @@ class CrowdExperiment(Experiment):
         :return: The heatmap label tensor and heatmap predicted label tensor.
         :rtype: (torch.autograd.Variable, torch.autograd.Variable)
         """
-        mappable = matplotlib.cm.ScalarMappable(cmap='inferno')
-        label_array = label.numpy()
-        predicted_label_array = predicted_label.numpy()
+        mappable = self.heatmap_mappable
+        label_array = label.cpu().numpy()
+        predicted_label_array = predicted_label.cpu().numpy()
         mappable.set_clim(vmin=min(label_array.min(), predicted_label_array.min()),
                           vmax=max(label_array.max(), predicted_label_array.max()))
-        patch_size = self.settings.image_patch_size
-        resized_label_array = scipy.misc.imresize(label_array, (patch_size, patch_size), mode='F')
-        label_heatmap_array = mappable.to_rgba(resized_label_array).astype(np.float32)
+        label_heatmap_array = mappable.to_rgba(label_array).astype(np.float32)
         label_heatmap_tensor = torch.as_tensor(label_heatmap_array[:, :, :3].transpose((2, 0, 1)))
-        resized_predicted_label_array = scipy.misc.imresize(predicted_label_array, (patch_size,
-                                                                                    patch_size), mode='F')
-        predicted_label_heatmap_array = mappable.to_rgba(resized_predicted_label_array).astype(np.float32)
+        predicted_label_heatmap_array = mappable.to_rgba(predicted_label_array).astype(np.float32)
         predicted_label_heatmap_tensor = torch.as_tensor(predicted_label_heatmap_array[:, :, :3].transpose((2, 0, 1)))
         return label_heatmap_tensor, predicted_label_heatmap_tensor
 
+    @staticmethod
+    def create_fake_images_grid_image(fake_examples):
+        """
+        Creates a grid of the first fake images. The images are converted to uint8 and gridded on the device, so only
+        the final (C,H,W) uint8 grid is copied to the CPU.
+
+        :param fake_examples: The generated images, in the -1 to 1 range.
+        :type fake_examples: torch.Tensor
+        :return: The image of the grid of images.
+        :rtype: np.ndarray
+        """
+        images = to_image_range(fake_examples.detach()[:9]).clamp(0, 255).to(torch.uint8)
+        return torchvision.utils.make_grid(images, nrow=3).cpu().numpy()
+
     def create_map_comparison_image(self, images, labels, predicted_labels, number_of_images=3):
         """
         Creates a grid of images from the original images, the true maps, and each predicted map.
@@ -231,12 +239,19 @@ class CrowdExperiment(Experiment):
         :return: The image of the grid of images.
         :rtype: np.ndarray
         """
+        number_of_images = min(number_of_images, images.size()[0])
+        images = images[:number_of_images].cpu()
+        patch_size = self.settings.image_patch_size
+        # All the maps are resized in a single batch, with the label map as the first channel of each example.
+        all_maps = torch.cat([labels[:number_of_images].data.unsqueeze(1), predicted_labels[:number_of_images].data],
+                             dim=1)
+        resized_maps = F.interpolate(all_maps, size=(patch_size, patch_size), mode='bilinear', align_corners=False)
         grid_image_list = []
-        for image_index in range(min(number_of_images, images.size()[0])):
+        for image_index in range(number_of_images):
             grid_image_list.append((images[image_index].data + 1) / 2)
             for predicted_map_index in range(predicted_labels.size()[1]):
                 label_heatmap, predicted_label_heatmap = self.convert_density_maps_to_heatmaps(
-                    labels[image_index].data, predicted_labels[image_index, predicted_map_index].data
+                    resized_maps[image_index, 0], resized_maps[image_index, predicted_map_index + 1]
                 )
                 if predicted_map_index == 0:
                     grid_image_list.append(label_heatmap)
@@ -249,14 +264,17 @@ class CrowdExperiment(Experiment):
         head_labels, map_labels = labels
         maps = map_labels.unsqueeze(1)
         predicted_density_labels, predicted_count_labels, predicted_maps = predicted_labels
-        map_loss = (torch.abs(predicted_maps - maps)).mean(1).sum(1).sum(1).pow(order).mean()
-        count_loss = torch.abs(predicted_count_labels - head_labels.sum(1).sum(1)).pow(order).mean()
+        map_loss = (predicted_maps - maps).abs().mean(1).sum(dim=(1, 2)).pow(order).mean()
+        count_loss = (predicted_count_labels - head_labels.sum(dim=(1, 2))).abs().pow(order).mean()
         return count_loss + (map_loss * self.settings.map_multiplier)
 
     def images_to_predicted_labels(self, network, images):
-        """Runs the code to go from images to a predicted labels. Useful for overriding."""
-        predicted_densities, predicted_counts, predicted_maps = network(images)
-        return predicted_densities, predicted_counts, predicted_maps
+        """Runs the code to go from images to a predicted labels (in eval mode). Useful for overriding."""
+        if isinstance(network, OnnxNetwork):
+            return network(images)
+        traced_network = self.traced_network(network, images)
+        predicted_densities, predicted_counts, predicted_maps = traced_network(images)
+        return predicted_densities.float(), predicted_counts.float(), predicted_maps.float()
 
     def test_summaries(self):
         """Evaluates the model on test data during training."""
@@ -273,11 +291,13 @@ class CrowdExperiment(Experiment):
                 full_image, full_label, full_maps = test_dataset[index]
                 full_example = CrowdExample(image=full_image, label=full_label)
                 full_predicted_count, full_predicted_label = self.predict_full_example(full_example, network)
-                totals['Count error'] += np.abs(full_predicted_count - full_example.label.sum())
-                totals['NAE'] += np.abs(full_predicted_count - full_example.label.sum()) / full_example.label.sum()
-                totals['Density sum error'] += np.abs(full_predicted_label.sum() - full_example.label.sum())
-                totals['SE count'] += (full_predicted_count - full_example.label.sum()) ** 2
-                totals['SE density'] += (full_predicted_label.sum() - full_example.label.sum()) ** 2
+                label_sum = float(full_example.label.sum())
+                totals['Count error'] += (full_predicted_count - label_sum).abs()
+                totals['NAE'] += (full_predicted_count - label_sum).abs() / label_sum
+                totals['Density sum error'] += (full_predicted_label.sum() - label_sum).abs()
+                totals['SE count'] += (full_predicted_count - label_sum) ** 2
+                totals['SE density'] += (full_predicted_label.sum() - label_sum) ** 2
+            totals = {key: value.item() for key, value in totals.items()}
             if network is self.DNN:
                 summary_writer = self.dnn_summary_writer
             else:
@@ -303,12 +323,19 @@ class CrowdExperiment(Experiment):
         """Evaluates the model on test data."""
         super().evaluate()
         for network in [self.DNN, self.D]:
+            evaluation_network = network
+            if self.settings.onnx_cpu_evaluation and not torch.cuda.is_available():
+                patch_size = self.settings.image_patch_size
+                evaluation_network = OnnxNetwork(network, torch.zeros([1, 3, patch_size, patch_size]))
             test_dataset = self.settings.dataset_class(dataset='test')
             totals = defaultdict(lambda: 0)
             for full_example_index, (full_image, full_label) in enumerate(test_dataset):
                 print('Processing full example {}...'.format(full_example_index), end='\r')
                 full_example = CrowdExample(image=full_image, label=full_label)
-                full_predicted_count, full_predicted_label = self.predict_full_example(full_example, network)
+                full_predicted_count, full_predicted_label = self.predict_full_example(full_example,
+                                                                                       evaluation_network)
+                full_predicted_count = full_predicted_count.item()
+                full_predicted_label = full_predicted_label.cpu().numpy()
                 totals['Count'] += full_example.label.sum()
                 totals['Density error'] += np.abs(full_predicted_label - full_example.label).sum()
                 totals['Count error'] += np.abs(full_predicted_count - full_example.label.sum())
@@ -337,61 +364,43 @@ class CrowdExperiment(Experiment):
         :type full_example: CrowdExample
         :param network: The network to process the patches.
         :type network: torch.nn.Module
-        :return: The predicted count array and density array.
-        :rtype: (np.ndarray, np.ndarray)
+        :return: The predicted count and density array (left on the device to avoid synchronizing).
+        :rtype: (torch.Tensor, torch.Tensor)
         """
-        sum_density_label = np.zeros_like(full_example.label, dtype=np.float32)
-        sum_count_label = np.zeros_like(full_example.label, dtype=np.float32)
-        hit_predicted_label = np.zeros_like(full_example.label, dtype=np.int32)
+        patch_size = self.settings.image_patch_size
+        half_patch_size = patch_size // 2
+        label_height, label_width = full_example.label.shape
+        # The accumulators are padded by half a patch on each side, so patches at the borders never need clipping.
+        padded_shape = (label_height + 2 * half_patch_size, label_width + 2 * half_patch_size)
+        # The channels are the density sum, the count sum, and the number of patches hitting each pixel.
+        accumulators = torch.zeros((3, *padded_shape), dtype=torch.float32, device=gpu)
         full_example_dataset = ImageSlidingWindowDataset(full_example, self.settings.image_patch_size,
                                                          self.settings.test_sliding_window_size)
         full_example_dataloader = DataLoader(full_example_dataset, batch_size=self.settings.batch_size,
                                              pin_memory=self.settings.pin_memory,
                                              num_workers=self.settings.number_of_data_workers)
-        patch_size = self.settings.image_patch_size
+        patch_y_offsets = torch.arange(patch_size, device=gpu).view(1, -1, 1) * padded_shape[1]
+        patch_x_offsets = torch.arange(patch_size, device=gpu).view(1, 1, -1)
         for batch in full_example_dataloader:
-            images = torch.stack([image for image in batch[0]])
-            predicted_labels, predicted_counts, predicted_maps = network(images.to(gpu))
-            predicted_labels, predicted_counts = predicted_labels.to('cpu'), predicted_counts.to('cpu')
-            for example_index, image in enumerate(batch[0]):
-                x = batch[1][example_index]
-                y = batch[2][example_index]
-                predicted_label = predicted_labels[example_index].detach().numpy()
-                try:
-                    predicted_count = predicted_counts[example_index].detach().numpy()
-                except IndexError:
-                    predicted_count = predicted_counts.detach().numpy()
-                predicted_label = scipy.misc.imresize(predicted_label, (patch_size, patch_size), mode='F')
-                predicted_label = predicted_label
-                predicted_count_array = np.full(predicted_label.shape,
-                                                predicted_count / predicted_label.size)
-                half_patch_size = patch_size // 2
-                y_start_offset = 0
-                if y - half_patch_size < 0:
-                    y_start_offset = half_patch_size - y
-                y_end_offset = 0
-                if y + half_patch_size > full_example.label.shape[0]:
-                    y_end_offset = y + half_patch_size - full_example.label.shape[0]
-                x_start_offset = 0
-                if x - half_patch_size < 0:
-                    x_start_offset = half_patch_size - x
-                x_end_offset = 0
-                if x + half_patch_size > full_example.label.shape[1]:
-                    x_end_offset = x + half_patch_size - full_example.label.shape[1]
-                sum_density_label[y - half_patch_size + y_start_offset:y + half_patch_size - y_end_offset,
-                                  x - half_patch_size + x_start_offset:x + half_patch_size - x_end_offset
-                                  ] += predicted_label[y_start_offset:predicted_label.shape[0] - y_end_offset,
-                                                       x_start_offset:predicted_label.shape[1] - x_end_offset]
-                sum_count_label[y - half_patch_size + y_start_offset:y + half_patch_size - y_end_offset,
-                                x - half_patch_size + x_start_offset:x + half_patch_size - x_end_offset
-                                ] += predicted_count_array[y_start_offset:predicted_count_array.shape[0] - y_end_offset,
-                                                           x_start_offset:predicted_count_array.shape[1] - x_end_offset]
-                hit_predicted_label[y - half_patch_size + y_start_offset:y + half_patch_size - y_end_offset,
-                                    x - half_patch_size + x_start_offset:x + half_patch_size - x_end_offset
-                                    ] += 1
-        hit_predicted_label[hit_predicted_label == 0] = 1
-        full_predicted_label = sum_density_label / hit_predicted_label.astype(np.float32)
-        full_predicted_count = np.sum(sum_count_label / hit_predicted_label.astype(np.float32))
+            images = batch[0].to(gpu, non_blocking=True).contiguous(memory_format=torch.channels_last)
+            predicted_labels, predicted_counts, predicted_maps = self.images_to_predicted_labels(network, images)
+            predicted_labels = F.interpolate(predicted_labels.detach().unsqueeze(1), size=(patch_size, patch_size),
+                                             mode='bilinear', align_corners=False).squeeze(1)
+            predicted_counts = predicted_counts.detach().view(-1, 1, 1)
+            x = batch[1].to(gpu).view(-1, 1, 1)
+            y = batch[2].to(gpu).view(-1, 1, 1)
+            # Indexes of each patch pixel in the flattened padded accumulators.
+            indexes = (y * padded_shape[1] + patch_y_offsets + x + patch_x_offsets).view(-1)
+            # The per-pixel count and hit values are broadcast scalars, only materialized by the single stack.
+            patch_values = torch.stack([predicted_labels,
+                                        (predicted_counts / (patch_size * patch_size)).expand_as(predicted_labels),
+                                        predicted_labels.new_ones(()).expand_as(predicted_labels)])
+            accumulators.view(3, -1).index_add_(1, indexes, patch_values.view(3, -1))
+        accumulators = accumulators[:, half_patch_size:half_patch_size + label_height,
+                                    half_patch_size:half_patch_size + label_width]
+        averages = accumulators[:2] / accumulators[2].clamp(min=1)
+        full_predicted_label = averages[0]
+        full_predicted_count = averages[1].sum()
         return full_predicted_count, full_predicted_label
 
     def batches_of_patches_with_position(self, full_example, window_step_size=32):
@@ -433,4 +442,4 @@ class CrowdExperiment(Experiment):
             predicted_count, predicted_label = self.predict_full_example(full_example=example,
                                                                          network=self.inference_network)
         print(datetime.datetime.now() - start)
-        return predicted_count, predicted_label
+        return predicted_count.item(), predicted_label.cpu().numpy()
@@ -73,7 +73,7 @@ class UcfCc50TransformedDataset(Dataset):
         self.start_indexes = []
         for file_name in self.file_names:
             self.start_indexes.append(self.length)
-            image = np.load(os.path.join(self.dataset_directory, 'images', file_name))
+            image = np.load(os.path.join(self.dataset_directory, 'images', file_name), mmap_mode='r')
             y_positions = range(half_patch_size, image.shape[0] - half_patch_size + 1)
             x_positions = range(half_patch_size, image.shape[1] - half_patch_size + 1)
             image_indexes_length = len(y_positions) * len(x_positions)
@@ -98,11 +98,9 @@ class UcfCc50TransformedDataset(Dataset):
                                                           allow_padded=True)  # In case image is smaller than patch.
         preprocess_transform = torchvision.transforms.Compose([NegativeOneToOneNormalizeImage(),
                                                                NumpyArraysToTorchTensors()])
-        image = np.load(os.path.join(self.dataset_directory, 'images', file_name))
-        label = np.load(os.path.join(self.dataset_directory, 'labels', file_name))
-        map_ = np.load(os.path.join(self.dataset_directory, self.map_directory_name, file_name))
-        if '1nn' in self.map_directory_name and 'i1nn' not in self.map_directory_name:
-            map_ = map_ / 112
+        image = np.load(os.path.join(self.dataset_directory, 'images', file_name), mmap_mode='r')
+        label = np.load(os.path.join(self.dataset_directory, 'labels', file_name), mmap_mode='r')
+        map_ = np.load(os.path.join(self.dataset_directory, self.map_directory_name, file_name), mmap_mode='r')
         half_patch_size = int(self.image_patch_size // 2)
         y_positions = range(half_patch_size, image.shape[0] - half_patch_size + 1)
         x_positions = range(half_patch_size, image.shape[1] - half_patch_size + 1)
@@ -116,6 +114,8 @@ class UcfCc50TransformedDataset(Dataset):
             example = self.middle_transform(example)
         example = preprocess_transform(example)
         map_ = example.map
+        if '1nn' in self.map_directory_name and 'i1nn' not in self.map_directory_name:
+            map_ = map_ / 112  # Scaled after the patch extraction, so only the patch of the memory mapped map is read.
         if self.inverse_map:
             map_ = 1 / (map_ + 1)
         return example.image, example.label, map_
@@ -58,7 +58,7 @@ class UcfQnrfTransformedDataset(Dataset):
     A class for the transformed UCF QNRF crowd dataset.
     """
     def __init__(self, dataset='train', image_patch_size=224, label_patch_size=224, seed=None, number_of_examples=None,
-                 middle_transform=None, map_directory_name='maps', examples_start=None):
+                 middle_transform=None, map_directory_name='maps', examples_start=None, normalize_image=True):
         seed_all(seed)
         if examples_start is None:
             examples_end = number_of_examples
@@ -83,6 +83,7 @@ class UcfQnrfTransformedDataset(Dataset):
             image_indexes_length = len(y_positions) * len(x_positions)
             self.length += image_indexes_length
         self.middle_transform = middle_transform
+        self.normalize_image = normalize_image
         self.map_directory_name = map_directory_name
 
     def __getitem__(self, index):
@@ -99,8 +100,11 @@ class UcfQnrfTransformedDataset(Dataset):
         position_index = index_ - start_index
         extract_patch_transform = ExtractPatchForPosition(self.image_patch_size, self.label_patch_size,
                                                           allow_padded=True)  # In case image is smaller than patch.
-        preprocess_transform = torchvision.transforms.Compose([NegativeOneToOneNormalizeImage(),
-                                                               NumpyArraysToTorchTensors()])
+        if self.normalize_image:
+            preprocess_transform = torchvision.transforms.Compose([NegativeOneToOneNormalizeImage(),
+                                                                   NumpyArraysToTorchTensors()])
+        else:
+            preprocess_transform = NumpyArraysToTorchTensors()
         image = np.load(os.path.join(self.dataset_directory, 'images', file_name), mmap_mode='r')
         label = np.load(os.path.join(self.dataset_directory, 'labels', file_name), mmap_mode='r')
         map_ = np.load(os.path.join(self.dataset_directory, self.map_directory_name, file_name), mmap_mode='r')
@@ -82,7 +82,7 @@ class WorldExpoTransformedDataset(Dataset):
     A class for the transformed World Expo crowd dataset.
     """
     def __init__(self, dataset='train', image_patch_size=224, label_patch_size=224, seed=None, number_of_cameras=None,
-                 number_of_images_per_camera=None, middle_transform=None):
+                 number_of_images_per_camera=None, middle_transform=None, normalize_image=True):
         seed_all(seed)
         self.dataset_directory = database_directory
         with open(os.path.join(self.dataset_directory, 'viable_with_validation_and_random_test.json')) as json_file:
@@ -120,6 +120,7 @@ class WorldExpoTransformedDataset(Dataset):
         self.image_patch_size = image_patch_size
         self.label_patch_size = label_patch_size
         self.middle_transform = middle_transform
+        self.normalize_image = normalize_image
 
     def __getitem__(self, index):
         """
@@ -145,8 +146,11 @@ class WorldExpoTransformedDataset(Dataset):
         map_ = label
         extract_patch_transform = ExtractPatchForPosition(self.image_patch_size, self.label_patch_size,
                                                           allow_padded=True)  # In case image is smaller than patch.
-        preprocess_transform = torchvision.transforms.Compose([NegativeOneToOneNormalizeImage(),
-                                                               NumpyArraysToTorchTensors()])
+        if self.normalize_image:
+            preprocess_transform = torchvision.transforms.Compose([NegativeOneToOneNormalizeImage(),
+                                                                   NumpyArraysToTorchTensors()])
+        else:
+            preprocess_transform = NumpyArraysToTorchTensors()
         y_positions = range(half_patch_size, image.shape[0] - half_patch_size + 1)
         x_positions = range(half_patch_size, image.shape[1] - half_patch_size + 1)
         positions_shape = [len(y_positions), len(x_positions)]
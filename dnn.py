@@ -78,23 +78,25 @@ class DnnExperiment(Experiment, ABC):
 
     def training_loop(self):
         """Runs the main training loop."""
-        train_dataset_generator = self.infinite_iter(self.train_dataset_loader)
+        train_dataset_generator = self.prefetched_infinite_iter(self.train_dataset_loader)
         step_time_start = datetime.datetime.now()
-        for step in range(self.starting_step, self.settings.steps_to_run):
-            self.adjust_learning_rate(step)
-            samples = next(train_dataset_generator)
-            if len(samples) == 2:
-                labeled_examples, labels = samples
-                labeled_examples, labels = labeled_examples.to(gpu), labels.to(gpu)
-            else:
-                labeled_examples, primary_labels, secondary_labels = samples
-                labeled_examples, labels = labeled_examples.to(gpu), (primary_labels.to(gpu), secondary_labels.to(gpu))
-            self.dnn_training_step(labeled_examples, labels, step)
-            if self.dnn_summary_writer.is_summary_step() or step == self.settings.steps_to_run - 1:
-                print('\rStep {}, {}...'.format(step, datetime.datetime.now() - step_time_start), end='')
-                step_time_start = datetime.datetime.now()
-                self.eval_mode()
-                with torch.no_grad():
-                    self.validation_summaries(step)
-                self.train_mode()
-            self.handle_user_input(step)
+        try:
+            for step in range(self.starting_step, self.settings.steps_to_run):
+                self.adjust_learning_rate(step)
+                samples = self.transform_batch(next(train_dataset_generator))
+                if len(samples) == 2:
+                    labeled_examples, labels = samples
+                else:
+                    labeled_examples, primary_labels, secondary_labels = samples
+                    labels = (primary_labels, secondary_labels)
+                self.dnn_training_step(labeled_examples, labels, step)
+                if self.dnn_summary_writer.is_summary_step() or step == self.settings.steps_to_run - 1:
+                    print('\rStep {}, {}...'.format(step, datetime.datetime.now() - step_time_start), end='')
+                    step_time_start = datetime.datetime.now()
+                    self.eval_mode()
+                    with torch.no_grad():
+                        self.validation_summaries(step)
+                    self.train_mode()
+                self.handle_user_input(step)
+        finally:
+            train_dataset_generator.close()
@@ -1,14 +1,12 @@
 """Code for the driving steering angle estimation application."""
-import numpy as np
 import torch
 import torchvision as torchvision
-from scipy.stats import norm
 from torch.utils.data import DataLoader
 
 from driving.models import Generator, Discriminator
 from driving.data import SteeringAngleDataset
 from srgan import Experiment
-from utility import seed_all, gpu, MixtureModel, to_image_range
+from utility import seed_all, gpu, to_image_range
 
 
 class DrivingExperiment(Experiment):
@@ -77,8 +75,7 @@ class DrivingExperiment(Experiment):
         fake_images_image = torchvision.utils.make_grid(to_image_range(fake_examples.data[:9]), normalize=True,
                                                         range=(0, 255), nrow=3)
         gan_summary_writer.add_image('Fake/Standard', fake_images_image.numpy())
-        z = torch.as_tensor(MixtureModel([norm(-settings.mean_offset, 1), norm(settings.mean_offset, 1)]
-                                         ).rvs(size=[settings.batch_size, G.input_size]).astype(np.float32)).to(gpu)
+        z = self.mixture_noise(settings.batch_size)
         fake_examples = G(z).to('cpu')
         fake_images_image = torchvision.utils.make_grid(to_image_range(fake_examples.data[:9]), normalize=True,
                                                         range=(0, 255), nrow=3)
@@ -87,17 +84,18 @@ class DrivingExperiment(Experiment):
     def evaluation_epoch(self, settings, network, dataset, summary_writer, summary_name, comparison_value=None):
         """Runs the evaluation and summaries for the data in the dataset."""
         dataset_loader = DataLoader(dataset, batch_size=settings.batch_size)
-        predicted_angles, angles = np.array([]), np.array([])
+        predicted_angles_list, angles_list = [], []
         for images, labels in dataset_loader:
-            batch_predicted_angles = self.images_to_predicted_angles(network, images.to(gpu))
-            batch_predicted_angles = batch_predicted_angles.detach().to('cpu').view(-1).numpy()
-            angles = np.concatenate([angles, labels])
-            predicted_angles = np.concatenate([predicted_angles, batch_predicted_angles])
-        mae = np.abs(predicted_angles - angles).mean()
+            batch_predicted_angles = self.images_to_predicted_angles(network, images.to(gpu, non_blocking=True))
+            predicted_angles_list.append(batch_predicted_angles.detach().view(-1))
+            angles_list.append(labels.to(gpu, dtype=torch.float32, non_blocking=True).view(-1))
+        predicted_angles, angles = torch.cat(predicted_angles_list), torch.cat(angles_list)
+        errors = predicted_angles - angles
+        mae = errors.abs().mean().item()
         summary_writer.add_scalar('{}/MAE'.format(summary_name), mae)
-        nmae = mae / (angles.max() - angles.min())
+        nmae = mae / (angles.max() - angles.min()).item()
         summary_writer.add_scalar('{}/NMAE'.format(summary_name), nmae)
-        mse = (np.abs(predicted_angles - angles) ** 2).mean()
+        mse = errors.pow(2).mean().item()
         summary_writer.add_scalar('{}/MSE'.format(summary_name), mse)
         if comparison_value is not None:
             summary_writer.add_scalar('{}/Ratio MAE GAN DNN'.format(summary_name), mae / comparison_value)
@@ -45,6 +45,8 @@ class Settings:
         self.skip_completed_experiment = True
         self.number_of_data_workers = 4
         self.pin_memory = True
+        self.mixed_precision_evaluation = False
+        self.onnx_cpu_evaluation = True
         self.continue_from_previous_trial = False
         self.continue_existing_experiments = False
         self.save_step_period = None
@@ -8,8 +8,6 @@ import select
 import sys
 from abc import ABC, abstractmethod
 
-import numpy as np
-from scipy.stats import norm
 from torch.nn import Module
 from torch.optim import Adam
 from torch.optim.optimizer import Optimizer
@@ -18,7 +16,8 @@ from torch.utils.data import Dataset, DataLoader
 from torch import Tensor
 
 from settings import Settings
-from utility import SummaryWriter, gpu, make_directory_name_unique, MixtureModel, seed_all, norm_squared, square_mean
+from utility import SummaryWriter, gpu, make_directory_name_unique, seed_all, norm_squared, square_mean, \
+    CUDAPrefetcher, ThreadPrefetcher
 
 
 class Experiment(ABC):
@@ -34,6 +33,7 @@ class Experiment(ABC):
         self.unlabeled_dataset: Dataset = None
         self.unlabeled_dataset_loader: DataLoader = None
         self.validation_dataset: Dataset = None
+        self.batch_transform: Module = None
         self.DNN: Module = None
         self.dnn_optimizer: Optimizer = None
         self.D: Module = None
@@ -42,6 +42,10 @@ class Experiment(ABC):
         self.g_optimizer: Optimizer = None
         self.signal_quit = False
         self.starting_step = 0
+        self.traced_networks = {}
+        self.evaluation_iterators = {}
+        self.mixture_means = torch.tensor([-settings.mean_offset, settings.mean_offset], dtype=torch.float32,
+                                          device=gpu)
 
         self.labeled_features = None
         self.unlabeled_features = None
@@ -98,35 +102,37 @@ class Experiment(ABC):
 
     def training_loop(self):
         """Runs the main training loop."""
-        train_dataset_generator = self.infinite_iter(self.train_dataset_loader)
-        unlabeled_dataset_generator = self.infinite_iter(self.unlabeled_dataset_loader)
+        train_dataset_generator = self.prefetched_infinite_iter(self.train_dataset_loader)
+        unlabeled_dataset_generator = self.prefetched_infinite_iter(self.unlabeled_dataset_loader)
         step_time_start = datetime.datetime.now()
-        for step in range(self.starting_step, self.settings.steps_to_run):
-            self.adjust_learning_rate(step)
-            # DNN.
-            samples = next(train_dataset_generator)
-            if len(samples) == 2:
-                labeled_examples, labels = samples
-                labeled_examples, labels = labeled_examples.to(gpu), labels.to(gpu)
-            else:
-                labeled_examples, primary_labels, secondary_labels = samples
-                labeled_examples, labels = labeled_examples.to(gpu), (primary_labels.to(gpu), secondary_labels.to(gpu))
-            self.dnn_training_step(labeled_examples, labels, step)
-            # GAN.
-            unlabeled_examples = next(unlabeled_dataset_generator)[0]
-            unlabeled_examples = unlabeled_examples.to(gpu)
-            self.gan_training_step(labeled_examples, labels, unlabeled_examples, step)
-
-            if self.gan_summary_writer.is_summary_step() or step == self.settings.steps_to_run - 1:
-                print('\rStep {}, {}...'.format(step, datetime.datetime.now() - step_time_start), end='')
-                step_time_start = datetime.datetime.now()
-                self.eval_mode()
-                with torch.no_grad():
-                    self.validation_summaries(step)
-                self.train_mode()
-            self.handle_user_input(step)
-            if self.settings.save_step_period and step % self.settings.save_step_period == 0 and step != 0:
-                self.save_models(step=step)
+        try:
+            for step in range(self.starting_step, self.settings.steps_to_run):
+                self.adjust_learning_rate(step)
+                # DNN.
+                samples = self.transform_batch(next(train_dataset_generator))
+                if len(samples) == 2:
+                    labeled_examples, labels = samples
+                else:
+                    labeled_examples, primary_labels, secondary_labels = samples
+                    labels = (primary_labels, secondary_labels)
+                self.dnn_training_step(labeled_examples, labels, step)
+                # GAN.
+                unlabeled_examples = self.transform_batch(next(unlabeled_dataset_generator))[0]
+                self.gan_training_step(labeled_examples, labels, unlabeled_examples, step)
+
+                if self.gan_summary_writer.is_summary_step() or step == self.settings.steps_to_run - 1:
+                    print('\rStep {}, {}...'.format(step, datetime.datetime.now() - step_time_start), end='')
+                    step_time_start = datetime.datetime.now()
+                    self.eval_mode()
+                    with torch.no_grad():
+                        self.validation_summaries(step)
+                    self.train_mode()
+                self.handle_user_input(step)
+                if self.settings.save_step_period and step % self.settings.save_step_period == 0 and step != 0:
+                    self.save_models(step=step)
+        finally:
+            train_dataset_generator.close()
+            unlabeled_dataset_generator.close()
 
     def prepare_optimizers(self):
         """Prepares the optimizers of the network."""
@@ -283,10 +289,7 @@ class Experiment(ABC):
         unlabeled_loss = self.unlabeled_loss_calculation(labeled_examples, unlabeled_examples)
         unlabeled_loss.backward()
         # Fake.
-        z = torch.tensor(MixtureModel([norm(-self.settings.mean_offset, 1),
-                                       norm(self.settings.mean_offset, 1)]
-                                      ).rvs(size=[unlabeled_examples.size(0),
-                                                  self.G.input_size]).astype(np.float32)).to(gpu)
+        z = self.mixture_noise(unlabeled_examples.size(0))
         fake_examples = self.G(z)
         fake_loss = self.fake_loss_calculation(unlabeled_examples, fake_examples)
         fake_loss.backward()
@@ -298,7 +301,7 @@ class Experiment(ABC):
         # Generator.
         if step % self.settings.generator_training_step_period == 0:
             self.g_optimizer.zero_grad()
-            z = torch.randn(unlabeled_examples.size(0), self.G.input_size).to(gpu)
+            z = torch.randn(unlabeled_examples.size(0), self.G.input_size).to(gpu, non_blocking=True)
             fake_examples = self.G(z)
             generator_loss = self.generator_loss_calculation(fake_examples, unlabeled_examples)
             generator_loss.backward()
@@ -319,6 +322,12 @@ class Experiment(ABC):
                                                    self.unlabeled_features.mean(0).norm().item())
         # self.D.apply(enable_batch_norm_updates)  # Only labeled data used for batch norm running statistics
 
+    def mixture_noise(self, batch_size):
+        """Samples generator input noise from an equal mixture of unit normals centered at +/- the mean offset."""
+        size = [batch_size, self.G.input_size]
+        component_indexes = torch.randint(0, 2, size, device=gpu)
+        return torch.randn(size, device=gpu) + self.mixture_means[component_indexes]
+
     def dnn_loss_calculation(self, labeled_examples, labels):
         """Calculates the DNN loss."""
         predicted_labels = self.DNN(labeled_examples)
@@ -422,6 +431,58 @@ class Experiment(ABC):
         self.load_models()
         self.eval_mode()
 
+    def data_loader_options(self):
+        """
+        The DataLoader keyword arguments for the long-lived training loaders. When there are workers, they are kept
+        alive between epochs, rather than being respawned for each pass over the data.
+        """
+        options = {'pin_memory': self.settings.pin_memory, 'num_workers': self.settings.number_of_data_workers}
+        if self.settings.number_of_data_workers > 0:
+            options.update(persistent_workers=True, prefetch_factor=4)
+        return options
+
+    def evaluation_batches(self, dataset, shuffle=False):
+        """
+        Gets the long-lived infinite iterator of evaluation batches for the dataset. Evaluations only take a few batches
+        at a time, so they continue from the same iterator rather than restarting a loader (and its workers) each time.
+        """
+        key = (id(dataset), shuffle)
+        if key not in self.evaluation_iterators:
+            data_loader = DataLoader(dataset, batch_size=self.settings.batch_size, shuffle=shuffle,
+                                     pin_memory=self.settings.pin_memory,
+                                     num_workers=self.settings.number_of_data_workers)
+            self.evaluation_iterators[key] = self.infinite_iter(data_loader)
+        return self.evaluation_iterators[key]
+
+    def transform_batch(self, batch):
+        """Applies the batch transform (if any) to a training batch which is already on the device."""
+        if self.batch_transform is None:
+            return batch
+        return self.batch_transform(batch)
+
+    def evaluation_autocast(self):
+        """
+        Creates the bfloat16 autocast context for evaluation forward passes. Only enabled if set in the settings and the
+        device is a GPU with bfloat16 support.
+        """
+        enabled = (self.settings.mixed_precision_evaluation and gpu.type == 'cuda' and
+                   torch.cuda.is_bf16_supported())
+        return torch.autocast(device_type=gpu.type, dtype=torch.bfloat16, enabled=enabled)
+
+    def traced_network(self, network, example_input):
+        """
+        Retrieves the TorchScript traced version of a network for evaluation, tracing it on first use. The trace shares
+        the network's parameters, but records the mode at trace time, so it should only be used in eval mode. Traces
+        are kept separately for use inside and outside autocast, as the trace records the casts.
+        """
+        key = (id(network), torch.is_autocast_enabled())
+        cached_network, traced_network = self.traced_networks.get(key, (None, None))
+        if cached_network is not network:
+            with torch.no_grad():
+                traced_network = torch.jit.trace(network, example_input, check_trace=False)
+            self.traced_networks[key] = (network, traced_network)
+        return traced_network
+
     @staticmethod
     def infinite_iter(dataset):
         """Create an infinite generator from a dataset"""
@@ -429,6 +490,10 @@ class Experiment(ABC):
             for examples in dataset:
                 yield examples
 
+    def prefetched_infinite_iter(self, data_loader):
+        """Create an infinite generator of batches from a data loader, with the batches prefetched onto the device."""
+        return CUDAPrefetcher(ThreadPrefetcher(self.infinite_iter(data_loader)), gpu)
+
     def adjust_learning_rate(self, step):
         """Sets the learning rate to the initial LR decayed by 10 every 30 epochs"""
         lr = self.settings.learning_rate * (0.1 ** (step // 100000))
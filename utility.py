@@ -1,9 +1,12 @@
 """
 Utility code to be used in miscellaneous cases.
 """
+import io
 import os
+import queue
 import random
 import re
+import threading
 import time
 import zipfile
 from urllib.request import urlretrieve
@@ -107,6 +110,130 @@ class MixtureModel(rv_continuous):
         return rvs
 
 
+class ThreadPrefetcher:
+    """
+    Wraps an iterator, fetching items ahead in a single background thread so that the next item is ready by the time
+    it is requested. Should be closed when no longer needed, as the thread otherwise waits on the queue indefinitely.
+    """
+    end_of_iteration = object()
+
+    def __init__(self, iterable, queue_size=1, put_timeout=0.1):
+        self.iterator = iter(iterable)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.put_timeout = put_timeout
+        self.stop_event = threading.Event()
+        self.exception = None
+        self.thread = threading.Thread(target=self.fetch, daemon=True)
+        self.thread.start()
+
+    def fetch(self):
+        """Puts the items into the queue, followed by the end of iteration sentinel when exhausted (or failed)."""
+        try:
+            for item in self.iterator:
+                if not self.put(item):
+                    return
+        except Exception as exception:
+            self.exception = exception
+        self.put(self.end_of_iteration)
+
+    def put(self, item):
+        """Puts an item into the queue, retrying until there is space or the prefetcher is closed."""
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=self.put_timeout)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def close(self):
+        """Stops the fetch thread, then releases the prefetched items and the wrapped iterator."""
+        self.stop_event.set()
+        self.thread.join()
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        close_iterator = getattr(self.iterator, 'close', None)
+        if close_iterator is not None:
+            close_iterator()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = self.queue.get()
+        if item is self.end_of_iteration:
+            self.queue.put(item)  # Keep the sentinel, so later calls also stop.
+            if self.exception is not None:
+                raise self.exception
+            raise StopIteration
+        return item
+
+
+class CUDAPrefetcher:
+    """
+    Wraps an iterator of batches, copying the next batch to the device on a side CUDA stream while the current batch
+    is being processed. On a CPU device, the batches are simply moved to the device.
+    """
+    def __init__(self, iterable, device=gpu):
+        self.iterator = iter(iterable)
+        self.device = torch.device(device)
+        self.stream = torch.cuda.Stream() if self.device.type == 'cuda' else None
+        self.next_batch = None
+        self.preload()
+
+    def preload(self):
+        """Starts the transfer of the next batch to the device."""
+        try:
+            batch = next(self.iterator)
+        except StopIteration:
+            self.next_batch = None
+            return
+        if self.stream is None:
+            self.next_batch = [tensor.to(self.device) for tensor in batch]
+        else:
+            with torch.cuda.stream(self.stream):
+                self.next_batch = [tensor.to(self.device, non_blocking=True) for tensor in batch]
+
+    def close(self):
+        """Releases the preloaded batch and closes the wrapped iterator."""
+        self.next_batch = None
+        close_iterator = getattr(self.iterator, 'close', None)
+        if close_iterator is not None:
+            close_iterator()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.next_batch is None:
+            raise StopIteration
+        batch = self.next_batch
+        if self.stream is not None:
+            current_stream = torch.cuda.current_stream()
+            current_stream.wait_stream(self.stream)
+            for tensor in batch:
+                tensor.record_stream(current_stream)
+        self.preload()
+        return batch
+
+
+class OnnxNetwork:
+    """
+    A network exported to ONNX and run with ONNX Runtime, which is faster than eager PyTorch for CPU-only inference.
+    Returns the network outputs as CPU tensors.
+    """
+    def __init__(self, network, example_input):
+        import onnxruntime
+        onnx_file = io.BytesIO()
+        torch.onnx.export(network, example_input, onnx_file, input_names=['input'], opset_version=17,
+                          dynamic_axes={'input': {0: 'batch'}})
+        self.session = onnxruntime.InferenceSession(onnx_file.getvalue(), providers=['CPUExecutionProvider'])
+
+    def __call__(self, input_):
+        outputs = self.session.run(None, {'input': input_.detach().cpu().contiguous().numpy()})
+        return tuple(torch.from_numpy(output) for output in outputs)
+
+
 def seed_all(seed=None):
     """Seed every type of random used by the SRGAN."""
     random.seed(seed)